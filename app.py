@@ -1,6 +1,6 @@
 import streamlit as st
 import requests
-import json
+import orjson
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
 from datetime import datetime
@@ -152,7 +152,7 @@ def generate_actions(title: str, content: str) -> Dict:
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.3
             )
-            return json.loads(resp.choices[0].message.content)
+            return orjson.loads(resp.choices[0].message.content)
         except Exception as e:
             st.warning(f"LLM 호출 실패(템플릿 사용): {e}")
 
@@ -0,0 +1,507 @@
+# scripts/cluster_core.py
+# 역할: cluster_and_generate*.py 공통 본체
+# raw_articles를 simhash prefix로 군집 → LLM(옵션) 재구성 → generated_articles 저장
+# 버전별 차이(모델, 프롬프트, 최소 군집 크기 등)는 CONFIGS의 설정 dict로만 나눈다.
+
+import os
+import time
+import asyncio
+import traceback
+import orjson
+from collections import defaultdict
+from datetime import timedelta
+from urllib.parse import urlparse
+from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from common import init_db, log_event, normalize, sim_prefix, IN_QUERY_LIMIT, BATCH_LIMIT
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# --- LLM 프롬프트: JSON만! (주석/코드펜스 금지) ---
+PROMPT = """You are a news rewrite assistant.
+Return ONLY a single JSON object. No code fences, no explanations, no comments.
+
+Required JSON shape:
+{
+  "title": "string",
+  "summary": "string",
+  "bullets": ["string", "string", "string"],
+  "facts": [{"text":"string","evidence_url":"string"}],
+  "actions": {
+    "stock":[{"action":"","assumptions":"","risk":"","alternative":""}],
+    "futures":[{"action":"","assumptions":"","risk":"","alternative":""}],
+    "biz":[{"action":"","assumptions":"","risk":"","alternative":""}]
+  }
+}
+
+Rules:
+- Use available sources (one or more). Cite at least 1 item in "facts" with evidence_url chosen from the given Sources list.
+- Cautious, factual tone. No guarantees/advice.
+- If mostly Korean sources, write Korean; otherwise English.
+
+Sources:
+{sources}
+"""
+
+# 여러 군집을 한 요청에 묶을 때 쓰는 프롬프트 (고정 지시문 토큰을 군집마다 반복하지 않도록)
+BATCH_PROMPT = """You are a news rewrite assistant.
+Each cluster below is a group of sources about the same event.
+Return ONLY a single JSON object. No code fences, no explanations, no comments.
+
+Required JSON shape:
+{
+  "results": [
+    {
+      "cluster_key": "string",
+      "title": "string",
+      "summary": "string",
+      "bullets": ["string", "string", "string"],
+      "facts": [{"text":"string","evidence_url":"string"}],
+      "actions": {
+        "stock":[{"action":"","assumptions":"","risk":"","alternative":""}],
+        "futures":[{"action":"","assumptions":"","risk":"","alternative":""}],
+        "biz":[{"action":"","assumptions":"","risk":"","alternative":""}]
+      }
+    }
+  ]
+}
+
+Rules:
+- Return exactly one result per cluster, copying its cluster_key.
+- Use only that cluster's sources. Cite at least 1 item in "facts" with evidence_url chosen from that cluster's Sources list.
+- Cautious, factual tone. No guarantees/advice.
+- If a cluster's sources are mostly Korean, write that result in Korean; otherwise English.
+
+Clusters:
+{sources}
+"""
+
+# 초기 버전 프롬프트 (다중 소스 전제, 근거 2개 이상)
+PROMPT_MULTI_SOURCE = """You are a news rewrite assistant.
+Given multiple sources about the same event, produce STRICT JSON:
+{
+ "title": str,
+ "summary": str,           // 600 chars max, factual, cautious
+ "bullets": [str, str, str],
+ "facts": [{"text": str, "evidence_url": str}],
+ "actions": {
+   "stock":[{"action":"","assumptions":"","risk":"","alternative":""}],
+   "futures":[{"action":"","assumptions":"","risk":"","alternative":""}],
+   "biz":[{"action":"","assumptions":"","risk":"","alternative":""}]
+ }
+}
+Rules:
+- Cite at least 2 evidence_url from given list.
+- No advice; cautious tone; avoid guarantees.
+- If mostly Korean sources, write Korean; otherwise English.
+Sources:
+{sources}
+"""
+
+# --- 응답 JSON 스키마 (structured outputs, strict: 모든 필드 필수 + 추가 필드 금지) ---
+def _obj(props):
+    return {"type": "object", "properties": props, "required": list(props), "additionalProperties": False}
+
+_STR = {"type": "string"}
+_ACTION = {"type": "array", "items": _obj({"action": _STR, "assumptions": _STR, "risk": _STR, "alternative": _STR})}
+ARTICLE_FIELDS = {
+    "title": _STR,
+    "summary": _STR,
+    "bullets": {"type": "array", "items": _STR},
+    "facts": {"type": "array", "items": _obj({"text": _STR, "evidence_url": _STR})},
+    "actions": _obj({"stock": _ACTION, "futures": _ACTION, "biz": _ACTION}),
+}
+ARTICLE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "news_rewrite", "strict": True, "schema": _obj(ARTICLE_FIELDS)},
+}
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "news_rewrite_batch",
+        "strict": True,
+        "schema": _obj({"results": {"type": "array", "items": _obj({"cluster_key": _STR, **ARTICLE_FIELDS})}}),
+    },
+}
+
+# --- 버전별 설정 (dispatch table) ---
+DEFAULT_CONFIG = {
+    "min_items": 1,                 # 군집 최소 기사 수 (1이면 단일 기사 군집도 생성)
+    "use_openai": bool(OPENAI_API_KEY),
+    "model": "gpt-4o-mini",
+    "temperature": 0.2,
+    "max_tokens": 800,              # 응답 스키마 분량에 맞춘 생성 토큰 상한
+    "concurrency": 8,               # 동시에 보낼 OpenAI 요청 수 (레이트 리밋 고려)
+    "max_sources": 5,               # 군집당 프롬프트에 넣을 최대 소스 수 (중복 제거 후 최신순)
+    "response_format": ARTICLE_RESPONSE_FORMAT,
+    "batch_response_format": BATCH_RESPONSE_FORMAT,
+    "prompt": PROMPT,
+    "batch_prompt": BATCH_PROMPT,
+    "clusters_per_request": 4,      # 한 OpenAI 요청에 묶을 군집 수 (1이면 군집마다 prompt로 개별 요청)
+}
+
+CONFIGS = {
+    "v1": {**DEFAULT_CONFIG, "prompt": PROMPT_MULTI_SOURCE, "clusters_per_request": 1},
+    "v2": DEFAULT_CONFIG,
+    "v3": DEFAULT_CONFIG,
+    "v4": {
+        **DEFAULT_CONFIG,
+        "use_openai": bool(OPENAI_API_KEY) and os.getenv("USE_OPENAI", "False").lower() == "true",
+    },
+}
+
+# raw_articles 스트림 전체 타임아웃(초). RunQuery는 한 번의 스트리밍 RPC라 페이지 크기 옵션이 없음
+STREAM_TIMEOUT = 60
+
+def make_client(config):
+    """설정상 OpenAI를 쓰면 클라이언트 생성, 아니면(또는 실패 시) None."""
+    if not config["use_openai"]:
+        print(f"USE_OPENAI = False, OPENAI_API_KEY is {'set' if OPENAI_API_KEY else 'not set'}")
+        return None
+    try:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        print("✅ OpenAI client initialized successfully")
+        return client
+    except Exception as e:
+        print(f"❌ OpenAI client init failed: {e}")
+        print("Full stack trace:")
+        traceback.print_exc()
+        return None
+
+# 증분 로딩용 커서 문서: 직전 실행에서 본 raw_articles의 최대 created_at(수집 시각)
+STATE_DOC = ("state", "cluster_runner")
+
+def load_cursor(db):
+    snap = db.collection(STATE_DOC[0]).document(STATE_DOC[1]).get()
+    return (snap.to_dict() or {}).get("last_created_at") if snap.exists else None
+
+def save_cursor(db, last_created_at):
+    db.collection(STATE_DOC[0]).document(STATE_DOC[1]).set(
+        {"last_created_at": last_created_at, "updated_at": firestore.SERVER_TIMESTAMP}, merge=True
+    )
+
+# run_once가 raw_articles에서 실제로 읽는 필드 (content_hint 등은 받지 않음)
+RAW_FIELDS = ["title", "url", "published_at", "simhash", "sim_prefix_16", "created_at"]
+
+def cluster_prefix(it, prefix_bits=16):
+    """수집 시 저장한 sim_prefix_16을 우선 쓰고, 없는(이전) 문서만 simhash에서 계산."""
+    if prefix_bits == 16 and it.get("sim_prefix_16"):
+        return it["sim_prefix_16"]
+    return sim_prefix(it.get("simhash", ""), prefix_bits=prefix_bits)
+
+# 군집 대상 기사 창(published_at 기준)과 실행 주기(hourly.yml)
+WINDOW_SEC = 6 * 60 * 60
+RUN_INTERVAL_SEC = 60 * 60
+
+def load_recent_raw_groups(db, window_sec=WINDOW_SEC, prefix_bits=16, min_items=1, since_created=None):
+    now = int(time.time())
+    since = now - window_sec
+    col = db.collection("raw_articles")
+    if since_created is not None and min_items <= 1:
+        # 직전 실행 이후 수집된 기사만 읽는다. 그 전 기사로 만든 군집은 이미 생성돼 있어 어차피 건너뛴다.
+        # (published_at이 아니라 created_at 기준이라 늦게 수집된 기사도 놓치지 않음)
+        q = col.where(filter=FieldFilter("created_at", ">", since_created))
+    else:
+        q = col.where(filter=FieldFilter("published_at", ">=", since))
+    groups = defaultdict(list)
+    for d in q.select(RAW_FIELDS).stream(timeout=STREAM_TIMEOUT):
+        it = d.to_dict() or {}
+        if int(it.get("published_at", 0) or 0) < since:
+            continue
+        groups[cluster_prefix(it, prefix_bits)].append((d.id, it))
+    if min_items > 1:
+        # 한 번만 읽고 임계값 미만 군집은 버린다 (개수 세기용 스트림을 따로 돌리면 읽기 비용이 두 배)
+        groups = {k: v for k, v in groups.items() if len(v) >= min_items}
+    print(f"Loaded {len(groups)} clusters from raw_articles")
+    return groups
+
+def existing_cluster_keys(db, cluster_keys):
+    """이미 generated_articles에 있는 cluster_key 집합. 군집마다 조회하지 않고 in 쿼리로 묶어서 확인."""
+    keys = list(cluster_keys)
+    existing = set()
+    col = db.collection("generated_articles")
+    for i in range(0, len(keys), IN_QUERY_LIMIT):
+        q = col.where(filter=FieldFilter("cluster_key", "in", keys[i:i + IN_QUERY_LIMIT])).select(["cluster_key"])
+        existing.update((d.to_dict() or {}).get("cluster_key") for d in q.stream())
+    return existing
+
+def dedupe_items(items, max_items=None):
+    """같은 도메인 + 같은 제목(정규화) 기사는 하나만 남기고 최신순으로 최대 max_items개 반환."""
+    seen = set()
+    out = []
+    for _id, it in sorted(items, key=lambda x: int(x[1].get("published_at", 0) or 0), reverse=True):
+        key = (urlparse(it.get("url", "")).netloc.lower(), normalize(it.get("title", "")).lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        out.append((_id, it))
+        if max_items and len(out) >= max_items:
+            break
+    return out
+
+def make_payload_from_sources(items):
+    """LLM 미사용/실패 시 템플릿 페이로드."""
+    n = len(items)
+    title = f"[Auto] {n} source{'s' if n > 1 else ''} on same event"
+    summary = (
+        "Multiple outlets reported a similar event. (Template summary: LLM disabled)"
+        if n > 1
+        else "A single source reported this event. (Template summary: LLM disabled)"
+    )
+    bullets = ["Key point 1", "Key point 2", "Key point 3"]
+    first = items[0][1] if items else {}
+    facts = [{"text": first.get("title", ""), "evidence_url": first.get("url", "")}]
+    actions = {
+        "stock": [{
+            "action": "Watch related tickers",
+            "assumptions": "News momentum possible",
+            "risk": "Rumor/overreaction",
+            "alternative": "Stage entries"
+        }],
+        "futures": [{
+            "action": "Small sector ETF probe",
+            "assumptions": "Sector beta to news",
+            "risk": "Macro shocks",
+            "alternative": "Options spread"
+        }],
+        "biz": [{
+            "action": "Monitor supplier/customer notes",
+            "assumptions": "Lead-time/price impact",
+            "risk": "Overreacting pre-confirmation",
+            "alternative": "Phase-in after cross-check"
+        }],
+    }
+    return {"title": title, "summary": summary, "bullets": bullets, "facts": facts, "actions": actions}
+
+def template_result(job):
+    return {
+        "payload": make_payload_from_sources(job["sources"]),
+        "token_usage": {"prompt": 0, "completion": 0},
+        "latency_ms": 0,
+        "model_used": "template",
+    }
+
+# request_llm 실패 표시: RETRY는 일시적 실패(잘림/레이트 리밋/타임아웃/5xx) → 저장하지 않고 다음 실행에서 재시도,
+# GIVE_UP은 다시 보내도 같은 결과일 실패(인증/쿼터/거절/스키마 불일치/응답 누락) → 템플릿 저장
+RETRY, GIVE_UP = "retry", "give_up"
+
+def is_transient(e):
+    """다음 실행에서 다시 시도할 만한 OpenAI 오류인지."""
+    from openai import APIConnectionError, APIStatusError
+    if isinstance(e, APIConnectionError):      # APITimeoutError 포함
+        return True
+    if isinstance(e, APIStatusError):
+        if e.status_code == 429:
+            return getattr(e, "code", None) != "insufficient_quota"
+        return e.status_code >= 500
+    return False
+
+async def request_llm(client, sem, config, db, batch, prompts):
+    """군집 묶음을 LLM 한 번으로 재구성. 결과는 batch 순서대로, 실패한 군집은 RETRY/GIVE_UP."""
+    results = [GIVE_UP] * len(batch)
+    keys = [job["cluster_key"] for job in batch]
+    batched = len(batch) > 1
+    if batched:
+        head, tail = prompts["batch"]
+        response_format = config["batch_response_format"]
+        body = "\n\n".join(f"[cluster_key: {job['cluster_key']}]\n" + "\n".join(job["src_lines"]) for job in batch)
+    else:
+        head, tail = prompts["single"]
+        response_format = config["response_format"]
+        body = "\n".join(batch[0]["src_lines"])
+
+    content = None
+    async with sem:
+        try:
+            t0 = time.time()
+            print(f"Sending OpenAI request for clusters {keys} with {sum(len(j['src_lines']) for j in batch)} sources")
+            resp = await client.chat.completions.create(
+                model=config["model"],
+                messages=[{"role": "user", "content": head + body + tail}],
+                temperature=config["temperature"],
+                max_tokens=config["max_tokens"] * len(batch),
+                response_format=response_format,
+            )
+            latency_ms = int((time.time() - t0) * 1000)
+
+            # 묶음 요청의 토큰은 군집 수로 나눠 기록
+            token_usage = {"prompt": 0, "completion": 0}
+            try:
+                token_usage["prompt"] = getattr(resp.usage, "prompt_tokens", 0) // len(batch)
+                token_usage["completion"] = getattr(resp.usage, "completion_tokens", 0) // len(batch)
+            except Exception:
+                pass
+
+            choice = resp.choices[0]
+            if choice.finish_reason == "length":
+                # max_tokens에서 잘린 JSON은 파싱 불가. 템플릿을 저장하면 existing_cluster_keys 때문에
+                # 영영 다시 생성되지 않으므로 비워 두고 다음 실행에서 재시도
+                print(f"OpenAI response truncated at max_tokens for clusters {keys}")
+                await asyncio.to_thread(log_event, db, "openai_truncated", {
+                    "cluster_key": ",".join(keys),
+                    "max_tokens": config["max_tokens"] * len(batch),
+                    "completion_tokens": getattr(resp.usage, "completion_tokens", None),
+                })
+                return [RETRY] * len(batch)
+
+            message = choice.message
+            content = getattr(message, "content", None)
+            if not content:
+                raise ValueError(f"empty response (refusal={getattr(message, 'refusal', None)!r})")
+
+            # ✅ 디버깅 출력
+            print(f"🔎 LLM RESPONSE START ({', '.join(keys)})")
+            print(content)
+            print(f"🔎 LLM RESPONSE END ({', '.join(keys)})")
+
+            # json_schema(strict)라 응답은 항상 스키마에 맞는 JSON: 코드펜스/중괄호 복구 없이 바로 파싱
+            parsed = orjson.loads(content)
+            if batched:
+                by_key = {r.get("cluster_key"): r for r in parsed.get("results", []) if isinstance(r, dict)}
+            else:
+                by_key = {keys[0]: parsed}
+            for i, key in enumerate(keys):
+                if key not in by_key:
+                    print(f"OpenAI response missing cluster {key}")
+                    continue
+                results[i] = {
+                    "payload": by_key[key], "token_usage": dict(token_usage),
+                    "latency_ms": latency_ms, "model_used": config["model"],
+                }
+
+        except Exception as e:
+            print(f"OpenAI error for clusters {keys}: {repr(e)}")
+            print("Trace:\n", traceback.format_exc())
+            await asyncio.to_thread(log_event, db, "openai_error", {
+                "msg": str(e),
+                "raw_content": content if content is not None else "N/A",
+                "cluster_key": ",".join(keys)
+            })
+            if is_transient(e):
+                return [RETRY] * len(batch)
+    return results
+
+async def generate_batch(client, sem, config, db, batch, prompts):
+    """묶음 요청이 실패하거나 응답에서 빠진 군집만 군집별 단일 요청으로 다시 보낸다.
+    그래도 일시적 실패(RETRY)면 None(저장하지 않고 다음 실행에서 재시도), 그 외 실패는 템플릿."""
+    results = await request_llm(client, sem, config, db, batch, prompts)
+    failed = [i for i, res in enumerate(results) if not isinstance(res, dict)]
+    if len(batch) > 1 and failed:
+        print(f"Retrying {len(failed)} of {len(batch)} clusters as single requests")
+        retried = await asyncio.gather(*(request_llm(client, sem, config, db, [batch[i]], prompts) for i in failed))
+        for i, res in zip(failed, retried):
+            results[i] = res[0]
+    return [
+        None if res == RETRY else template_result(job) if res == GIVE_UP else res
+        for job, res in zip(batch, results)
+    ]
+
+async def generate_all(config, db, jobs):
+    """clusters_per_request개씩 묶어 LLM 요청을 concurrency 개까지 동시에 보낸다. 결과는 jobs 순서대로."""
+    client = make_client(config)
+    if client is None:
+        return [template_result(job) for job in jobs]
+    sem = asyncio.Semaphore(config["concurrency"])
+    # {sources}만 바뀌므로 실행당 한 번만 나눠 두고 요청마다 이어 붙인다 (str.format 파싱 생략)
+    prompts = {
+        "single": config["prompt"].split("{sources}"),
+        "batch": config["batch_prompt"].split("{sources}"),
+    }
+    k = max(1, config["clusters_per_request"])
+    batches = [jobs[i:i + k] for i in range(0, len(jobs), k)]
+    out = await asyncio.gather(*(generate_batch(client, sem, config, db, b, prompts) for b in batches))
+    return [res for batch_results in out for res in batch_results]
+
+def run_once(config=DEFAULT_CONFIG):
+    min_items = config["min_items"]
+
+    db = init_db()
+    groups = load_recent_raw_groups(db, min_items=min_items, since_created=load_cursor(db))
+    created = 0
+
+    existing = existing_cluster_keys(db, groups.keys())
+    jobs = []
+    for cluster_key, items in groups.items():
+        if len(items) < min_items:
+            continue
+        if cluster_key in existing:
+            print(f"Skipping cluster {cluster_key}: already generated")
+            continue
+
+        ts = [int(it.get("published_at", 0) or 0) for _, it in items]
+        ts_min, ts_max = min(ts), max(ts)
+
+        # 소스 문자열 (제목 | URL) 나열: 같은 기사 중복은 빼고 최신순 상위만
+        sources = dedupe_items(items, config["max_sources"])
+        n = len(sources)
+        src_lines, urls = [None] * n, [None] * n
+        for i, (_id, it) in enumerate(sources):
+            title, url = it.get('title', ''), it.get('url', '')
+            urls[i] = url
+            src_lines[i] = f"- {title} | {url}"
+        jobs.append({
+            "cluster_key": cluster_key, "items": items, "sources": sources, "src_lines": src_lines,
+            "urls": urls, "ts_min": ts_min, "ts_max": ts_max,
+        })
+
+    results = asyncio.run(generate_all(config, db, jobs)) if jobs else []
+
+    # 다음 실행 전에 창(published_at)에서 빠질 군집은 더 미루지 않고 템플릿으로 저장
+    expiring = int(time.time()) - WINDOW_SEC + RUN_INTERVAL_SEC
+    for i, (job, res) in enumerate(zip(jobs, results)):
+        if res is None and job["ts_max"] < expiring:
+            print(f"Giving up on cluster {job['cluster_key']}: leaving the window, saving template")
+            log_event(db, "openai_gave_up", {"cluster_key": job["cluster_key"], "published_end": job["ts_max"]})
+            results[i] = template_result(job)
+
+    col = db.collection("generated_articles")
+    batch = db.batch()
+    retry = []
+    for job, res in zip(jobs, results):
+        if res is None:
+            retry.append(job)
+            continue
+        cluster_key, payload = job["cluster_key"], res["payload"]
+        doc = {
+            "cluster_key": cluster_key,
+            "title": payload.get("title", ""),
+            "summary": payload.get("summary", ""),
+            "bullets": payload.get("bullets", []),
+            "facts": payload.get("facts", []),
+            "actions": payload.get("actions", {"stock": [], "futures": [], "biz": []}),
+            "evidence_urls": job["urls"],
+            "raw_refs": [x[0] for x in job["items"]],
+            "published_window": {"start": job["ts_min"], "end": job["ts_max"]},
+            "model": res["model_used"],         # ← 실제 사용 모델만 기록
+            "token_usage": res["token_usage"],
+            "latency_ms": res["latency_ms"],
+            "created_at": firestore.SERVER_TIMESTAMP,
+        }
+        batch.set(col.document(), doc)
+        created += 1
+        print(f"Generated article for cluster {cluster_key}, total created={created}")
+        if created % BATCH_LIMIT == 0:
+            batch.commit()
+            batch = db.batch()
+    if created % BATCH_LIMIT:
+        batch.commit()
+
+    last_created_at = max(
+        (it["created_at"] for items in groups.values() for _, it in items if it.get("created_at")),
+        default=None,
+    )
+    held = [it["created_at"] for job in retry for _, it in job["items"] if it.get("created_at")]
+    if held:
+        # 저장하지 못한 군집의 기사는 다음 실행에서 다시 읽히도록 커서를 그 직전까지만 옮긴다
+        # (그 사이 생성된 군집은 existing_cluster_keys로 건너뜀)
+        last_created_at = min(held) - timedelta(microseconds=1)
+    if last_created_at is not None:
+        save_cursor(db, last_created_at)
+
+    log_event(db, "generate_done", {"created": created, "retry": len(retry)})
+    print(f"Found {len(groups)} clusters, generated={created}, retry next run={len(retry)}")
+
+if __name__ == "__main__":
+    import sys
+    run_once(CONFIGS[sys.argv[1] if len(sys.argv) > 1 else "v4"])
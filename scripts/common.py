@@ -1,4 +1,7 @@
-import os, re, json, time, hashlib
+import os, re, time, hashlib
+import numpy as np
+import orjson
+import xxhash
 import firebase_admin
 from firebase_admin import credentials, firestore
 from dateutil import parser as dtparser
@@ -16,15 +19,20 @@ def init_db():
     if not svc:
         raise RuntimeError("FIREBASE_SERVICE_ACCOUNT not set")
     try:
-        data = json.loads(svc)  # JSON 문자열로 들어온 경우
+        data = orjson.loads(svc)  # JSON 문자열로 들어온 경우
         cred = credentials.Certificate(data)
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         # 파일 경로로 들어온 경우 (드물지만 대비)
         cred = credentials.Certificate(svc)
     if not firebase_admin._apps:
         firebase_admin.initialize_app(cred)
     return firestore.client()
 
+# Firestore "in" 필터 한 번에 넣을 수 있는 값 개수 상한
+IN_QUERY_LIMIT = 30
+# WriteBatch 한 번에 커밋할 수 있는 쓰기 개수 상한
+BATCH_LIMIT = 500
+
 # --- time utils ---
 def now_epoch():
     return int(time.time())
@@ -42,21 +50,36 @@ def normalize(t: str) -> str:
 def sha256(text: str) -> str:
     return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
+# simhash 토큰: 영숫자/한글 연속 구간 (소문자화 후)
+_TOKEN_RE = re.compile(r"[A-Za-z0-9가-힣]+")
+
 def simhash(text: str, bits: int = 64) -> str:
-    # 아주 가벼운 simhash (토큰 단위)
-    toks = re.findall(r"[A-Za-z0-9가-힣]+", (text or "").lower())
-    if not toks:
-        return "0" * (bits // 4)
-    v = [0] * bits
-    for tok in toks:
-        h = int(hashlib.md5(tok.encode()).hexdigest(), 16)
-        for i in range(bits):
-            v[i] += 1 if (h >> i) & 1 else -1
-    out = 0
-    for i in range(bits):
-        if v[i] >= 0:
-            out |= (1 << i)
-    return f"{out:0{bits//4}x}"
+    # 아주 가벼운 simhash (토큰 단위, bits는 8~64 사이 8의 배수)
+    return simhash_batch([text], bits)[0]
+
+def simhash_batch(texts, bits: int = 64) -> list:
+    # 토큰 해시(비암호 해시 xxh64, big-endian 8바이트)의 하위 bits 비트를 (토큰 수, bits) 0/1 행렬로 펼쳐
+    # 열마다 +1/-1 합산 (비트 루프는 NumPy에서). 여러 기사는 토큰을 이어 붙여 해시·비트 전개를 한 번만 하고
+    # 기사별 구간(offset)마다 reduceat으로 합산
+    if bits % 8 or not 8 <= bits <= 64:
+        # xxh64 다이제스트(8바이트)를 바이트 단위로 자르므로 이 범위 밖은 길이가 어긋난 결과가 나옴
+        raise ValueError(f"simhash bits must be a multiple of 8 between 8 and 64, got {bits}")
+    tok_lists = [_TOKEN_RE.findall((t or "").lower()) for t in texts]
+    counts = np.array([len(toks) for toks in tok_lists], dtype=np.int64)
+    out = ["0" * (bits // 4)] * len(texts)
+    nonempty = np.flatnonzero(counts)
+    if not len(nonempty):
+        return out
+    nbytes = bits // 8
+    digests = np.frombuffer(
+        b"".join(xxhash.xxh64_digest(tok.encode()) for toks in tok_lists for tok in toks), dtype=np.uint8
+    )
+    bit_mat = np.unpackbits(digests.reshape(-1, 8)[:, 8 - nbytes:], axis=1)  # MSB 먼저
+    starts = np.concatenate(([0], np.cumsum(counts[nonempty])[:-1]))
+    v = np.add.reduceat(bit_mat, starts, axis=0, dtype=np.int64) * 2 - counts[nonempty, None]
+    for i, row in zip(nonempty, np.packbits(v >= 0, axis=1)):
+        out[i] = row.tobytes().hex()
+    return out
 
 def sim_prefix(simhash_hex: str, prefix_bits: int = 16) -> str:
     return simhash_hex[: prefix_bits // 4]
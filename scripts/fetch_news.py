@@ -1,15 +1,24 @@
 # 역할: NewsAPI(+옵션 RSS)에서 기사 수집 → URL 기준 완전 중복만 제거 → raw_articles 저장
 # (유사 기사들은 남겨둠 → 다음 단계에서 묶어서 재구성)
 
-import os, requests, feedparser
-from common import init_db, now_epoch, to_epoch, normalize, sha256, simhash, log_event, doc_id_from_url
+import os, re, html, requests, feedparser, atoma, orjson
+from requests.adapters import HTTPAdapter
+from common import init_db, now_epoch, to_epoch, normalize, sha256, simhash_batch, sim_prefix, log_event, doc_id_from_url, IN_QUERY_LIMIT, BATCH_LIMIT
 from firebase_admin import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
 
 
 
 NEWSAPI_KEY = os.getenv("NEWSAPI_KEY")
 RSS_SOURCES = os.getenv("RSS_SOURCES", "")
 
+# NewsAPI/RSS 요청이 연결을 재사용하도록(keep-alive, TLS 핸드셰이크 생략) 세션 하나를 공유
+SESSION = requests.Session()
+SESSION.headers["User-Agent"] = feedparser.USER_AGENT
+SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+SESSION.mount("http://", HTTPAdapter(pool_connections=20, pool_maxsize=20))
+
 def fetch_newsapi():
     if not NEWSAPI_KEY:
         return []
@@ -19,9 +28,9 @@ def fetch_newsapi():
         "pageSize": 50,
         "apiKey": NEWSAPI_KEY
     }
-    r = requests.get(url, params=params, timeout=20)
+    r = SESSION.get(url, params=params, timeout=20)
     r.raise_for_status()
-    data = r.json()
+    data = orjson.loads(r.content)
     out = []
     for a in data.get("articles", []):
         title = normalize(a.get("title"))
@@ -39,49 +48,127 @@ def fetch_newsapi():
         })
     return out
 
+def _epoch(dt):
+    return int(dt.timestamp()) if dt else now_epoch()
+
+# XML 선언/주석/DOCTYPE 뒤 첫 요소(루트) 이름. <feedburner:info> 같은 채널 내부 요소와 헷갈리지 않도록 루트만 본다
+_XML_ROOT = re.compile(rb"\s*(?:<\?.*?\?>\s*|<!--.*?-->\s*|<!DOCTYPE[^>]*>\s*)*<(?:[\w.-]+:)?([\w.-]+)", re.S)
+
+def _feed_root(content):
+    m = _XML_ROOT.match(content.lstrip(b"\xef\xbb\xbf"))
+    return m.group(1).lower() if m else b""
+
+def _atom_text(tc):
+    """Atom 텍스트 → 문자열. type="html"은 엔티티가 이스케이프된 채 오므로 풀어 준다 (feedparser와 같은 결과)"""
+    if tc is None:
+        return ""
+    return html.unescape(tc.value) if tc.text_type == atoma.atom.AtomTextType.html else tc.value
+
+def _permalink(guid):
+    # <link> 없는 항목은 feedparser처럼 URL 형태의 guid(permalink)를 링크로 사용
+    return guid if guid and guid.startswith(("http://", "https://")) else None
+
+def parse_feed(content, content_type=""):
+    """피드 바이트 → (피드 제목, [(title, link, published_at, summary)]).
+    atoma(C expat 기반 RSS/Atom 파서) 우선, 형식이 어긋난 피드만 feedparser로 폴백"""
+    try:
+        if _feed_root(content) == b"feed":     # Atom 루트 요소
+            feed = atoma.parse_atom_bytes(content)
+            entries = []
+            for e in feed.entries:
+                link = next((l.href for l in e.links if l.rel in (None, "alternate")), None)
+                entries.append((_atom_text(e.title), link, _epoch(e.published or e.updated), _atom_text(e.summary)))
+            return _atom_text(feed.title) or "rss", entries
+        feed = atoma.parse_rss_bytes(content)
+        entries = [(i.title or "", i.link or _permalink(i.guid), _epoch(i.pub_date), i.description or "")
+                   for i in feed.items]
+        return feed.title or "rss", entries
+    except Exception as e:
+        # atoma 예외뿐 아니라 int("60 min") 같은 ValueError, defusedxml의 EntitiesForbidden(DOCTYPE 엔티티)도
+        # 여기로 온다. 관대한 feedparser로 다시 파싱
+        print(f"atoma parse failed ({e!r}), falling back to feedparser")
+
+    feed = feedparser.parse(content, response_headers={"content-type": content_type})
+    src_name = (getattr(feed, "feed", {}) or {}).get("title", "rss")
+    entries = []
+    for e in getattr(feed, "entries", []):
+        published = getattr(e, "published", "") or getattr(e, "updated", "")
+        entries.append((getattr(e, "title", ""), getattr(e, "link", None),
+                        to_epoch(published, default=now_epoch()), getattr(e, "summary", "")))
+    return src_name, entries
+
 def fetch_rss():
     if not RSS_SOURCES.strip():
         return []
     out = []
     for u in [x.strip() for x in RSS_SOURCES.split(",") if x.strip()]:
-        feed = feedparser.parse(u)
-        src_name = (getattr(feed, "feed", {}) or {}).get("title", "rss")
-        for e in getattr(feed, "entries", []):
-            title = normalize(getattr(e, "title", ""))
-            link = getattr(e, "link", None)
+        try:
+            r = SESSION.get(u, timeout=20)
+            r.raise_for_status()
+        except requests.RequestException as e:
+            print(f"RSS fetch failed: {u} ({e})")
+            continue
+        try:
+            src_name, entries = parse_feed(r.content, r.headers.get("content-type", ""))
+        except Exception as e:
+            # 피드 하나가 깨져도 나머지 피드 수집은 계속
+            print(f"RSS parse failed: {u} ({e!r})")
+            continue
+        for title, link, published_at, summary in entries:
+            title = normalize(title)
             if not title or not link:
                 continue
-            published = getattr(e, "published", "") or getattr(e, "updated", "")
             out.append({
                 "source": "rss",
                 "source_name": src_name,
                 "title": title,
                 "url": link,
-                "published_at": to_epoch(published, default=now_epoch()),
-                "content_hint": normalize(getattr(e, "summary", "")),
+                "published_at": published_at,
+                "content_hint": normalize(summary),
                 "lang": "en",
             })
     return out
 
 
+def existing_doc_ids(col, doc_ids):
+    """이미 저장된 문서 ID 집합. 기사마다 get() 하지 않고 document_id in 쿼리로 묶어서 확인."""
+    existing = set()
+    for i in range(0, len(doc_ids), IN_QUERY_LIMIT):
+        refs = [col.document(x) for x in doc_ids[i:i + IN_QUERY_LIMIT]]
+        q = col.where(filter=FieldFilter(FieldPath.document_id(), "in", refs)).select([])
+        existing.update(d.id for d in q.stream())
+    return existing
+
+
 def save_raw(db, items):
     saved, skipped, updated = 0, 0, 0
     col = db.collection("raw_articles")
 
+    # 같은 URL이 NewsAPI/RSS에 겹쳐 들어오면 첫 번째만 사용
+    by_id = {}
     for it in items:
+        doc_id = doc_id_from_url(it["url"])     # URL 해시 = 문서 ID
+        if doc_id in by_id:
+            skipped += 1
+            continue
+        by_id[doc_id] = it
+    existing = existing_doc_ids(col, list(by_id))
+    # 유사도 군집용 값 계산 (제목+요약 힌트): 기사 전체를 한 번에
+    hashes = simhash_batch([f"{it['title']} {it.get('content_hint','')}" for it in by_id.values()])
+
+    batch, ops = db.batch(), 0
+    for (doc_id, it), sh in zip(by_id.items(), hashes):
         url = it["url"]
-        doc_id = doc_id_from_url(url)           # URL 해시 = 문서 ID
         doc_ref = col.document(doc_id)
-        snap = doc_ref.get()
 
-        # 유사도 군집용 값 계산 (제목+요약 힌트)
         it["url_hash"] = sha256(url)            # 참고용 필드(쿼리/검증)
-        it["simhash"] = simhash(f"{it['title']} {it.get('content_hint','')}")
+        it["simhash"] = sh
+        it["sim_prefix_16"] = sim_prefix(it["simhash"], 16)   # 군집 키 (조회 시 재계산 안 하도록 저장)
         it.setdefault("created_at", firestore.SERVER_TIMESTAMP)
 
-        if snap.exists:
+        if doc_id in existing:
             # 이미 있으면 최신 메타만 업데이트 (예: published_at 오차 보정)
-            doc_ref.set({
+            batch.set(doc_ref, {
                 "source": it["source"],
                 "source_name": it["source_name"],
                 "title": it["title"],
@@ -90,13 +177,20 @@ def save_raw(db, items):
                 "content_hint": it.get("content_hint", ""),
                 "lang": it.get("lang","en"),
                 "simhash": it["simhash"],
+                "sim_prefix_16": it["sim_prefix_16"],
                 "url_hash": it["url_hash"],
                 "updated_at": firestore.SERVER_TIMESTAMP,
             }, merge=True)
             updated += 1
         else:
-            doc_ref.set(it)                     # 최초 저장
+            batch.set(doc_ref, it)              # 최초 저장
             saved += 1
+        ops += 1
+        if ops == BATCH_LIMIT:
+            batch.commit()
+            batch, ops = db.batch(), 0
+    if ops:
+        batch.commit()
 
     return saved, skipped, updated
 
@@ -120,6 +214,6 @@ if __name__ == "__main__":
 
 
     saved, skipped, updated = save_raw(db, all_items)
-    log_event(db, "ingest_done", {"saved": saved, "updated": updated, "total": len(all_items)})
-    print(f"saved={saved} updated={updated} total={len(all_items)}")
+    log_event(db, "ingest_done", {"saved": saved, "updated": updated, "skipped": skipped, "total": len(all_items)})
+    print(f"saved={saved} updated={updated} skipped={skipped} total={len(all_items)}")
 